@@ -1,95 +1,404 @@
 import os
+import sys
+import gzip
 import json
+import logging
 import pandas as pd
 import numpy as np
-import time
 import random
-from datetime import datetime, timedelta
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 import yfinance as yf
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-class RobustStockAnalyzer:
-    def __init__(self):
-        self.watchlist = {
-            'US': ['AAPL', 'MSFT', 'TSLA', 'NVDA', 'GOOGL', 'META', 'AMZN', 'NFLX'],
-            'UK': ['TSCO.L', 'HSBA.L', 'LLOY.L', 'VOD.L', 'BARC.L'],
-            'EU': ['AIR.PA', 'SIE.DE', 'ASML.AS', 'SAF.PA', 'BMW.DE']
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numba
+    from numba import prange
+except ImportError:
+    numba = None
+    prange = range
+
+log = logging.getLogger(__name__)
+
+# Below this many tickers the searchsorted lookups are already faster than a kernel launch
+_KERNEL_MIN_BATCH = 1000
+
+def _band_points(value, thresholds, points):
+    """Points for the first band whose threshold is at or above value, as searchsorted finds it"""
+    if np.isnan(value):
+        return 0
+    for k in range(thresholds.shape[0]):
+        if value <= thresholds[k]:
+            return points[k]
+    return points[-1]
+
+def _score_kernel(price_change_pcts, volume_ratios, momentum_thresholds, momentum_points,
+                  volume_thresholds, volume_points):
+    """Score each ticker from the same threshold tables as StockAnalyzer.score_batch, in one loop"""
+    n = price_change_pcts.shape[0]
+    scores = np.empty(n, dtype=np.int64)
+    for i in prange(n):
+        score = (50
+                 + _band_points(price_change_pcts[i], momentum_thresholds, momentum_points)
+                 + _band_points(volume_ratios[i], volume_thresholds, volume_points))
+        scores[i] = min(max(score, 0), 100)
+    return scores
+
+if numba is not None:
+    # NaN checks above rule out fastmath; cache=True keeps the compiled kernel across runs
+    _band_points = numba.njit(cache=True)(_band_points)
+    _score_kernel = numba.njit(cache=True, parallel=True)(_score_kernel)
+else:
+    _score_kernel = None
+
+# Display names for the default watchlist; unknown tickers fall back to the symbol
+_NAME_MAP = {
+    'AAPL': 'Apple Inc.', 'MSFT': 'Microsoft Corporation', 
+    'TSLA': 'Tesla Inc.', 'NVDA': 'NVIDIA Corporation',
+    'GOOGL': 'Alphabet Inc.', 'META': 'Meta Platforms Inc.',
+    'AMZN': 'Amazon.com Inc.', 'NFLX': 'Netflix Inc.',
+    'TSCO.L': 'Tesco PLC', 'HSBA.L': 'HSBC Holdings PLC',
+    'LLOY.L': 'Lloyds Banking Group', 'VOD.L': 'Vodafone Group PLC',
+    'BARC.L': 'Barclays PLC', 'AIR.PA': 'Airbus SE',
+    'SIE.DE': 'Siemens AG', 'ASML.AS': 'ASML Holding NV',
+    'SAF.PA': 'Safran SA', 'BMW.DE': 'BMW AG'
+}
+
+# Realistic price ranges for each stock, used when generating sample data
+_PRICE_RANGES = {
+    'AAPL': (150, 200), 'MSFT': (300, 400), 'TSLA': (150, 300), 
+    'NVDA': (400, 800), 'GOOGL': (120, 150), 'META': (300, 400),
+    'AMZN': (120, 180), 'NFLX': (500, 700), 'TSCO.L': (2.5, 3.5),
+    'HSBA.L': (6, 8), 'LLOY.L': (0.4, 0.6), 'VOD.L': (0.6, 0.9),
+    'BARC.L': (1.5, 2.0), 'AIR.PA': (120, 160), 'SIE.DE': (140, 180),
+    'ASML.AS': (600, 800), 'SAF.PA': (180, 220), 'BMW.DE': (80, 110)
+}
+
+# User agents to rotate to avoid blocking
+_USER_AGENTS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36',
+)
+
+class CachedHistory:
+    """Parquet cache of daily bars per ticker, with a JSON sidecar of fetch times"""
+    
+    def __init__(self, cache_dir, ttl=timedelta(minutes=30)):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.meta_path = os.path.join(cache_dir, 'meta.json')
+        try:
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+        except (OSError, ValueError):
+            self.meta = {}
+    
+    def path(self, ticker):
+        return os.path.join(self.cache_dir, f"{ticker}.parquet")
+    
+    def is_fresh(self, ticker):
+        """Check whether a ticker was fetched within the TTL, so the network can be skipped"""
+        entry = self.meta.get(ticker, {})
+        try:
+            fetched_at = datetime.fromisoformat(entry['fetched_at'])
+        except (KeyError, ValueError):
+            return False
+        return datetime.now() - fetched_at < self.ttl and os.path.exists(self.path(ticker))
+    
+    def last_bar(self, ticker):
+        """Newest cached bar date, read from the sidecar instead of the Parquet file"""
+        entry = self.meta.get(ticker, {})
+        if 'last_bar' not in entry or not os.path.exists(self.path(ticker)):
+            return None
+        return pd.Timestamp(entry['last_bar'])
+    
+    def get(self, ticker):
+        """Load cached daily bars for a ticker, or None if nothing usable is cached"""
+        try:
+            return pd.read_parquet(self.path(ticker))
+        except Exception as e:
+            log.warning("  ⚠️ Ignoring unreadable cache for %s: %.50s", ticker, e)
+            return None
+    
+    def put(self, ticker, hist):
+        """Persist daily bars for a ticker and record when they were fetched"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            hist.to_parquet(self.path(ticker), compression='zstd')
+        except Exception as e:
+            log.warning("  ⚠️ Could not cache %s: %.50s", ticker, e)
+            return
+        self.meta[ticker] = {
+            'fetched_at': datetime.now().isoformat(),
+            'last_bar': hist.index[-1].isoformat()
         }
+    
+    def save_meta(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self.meta_path, 'w') as f:
+            json.dump(self.meta, f, indent=2)
+
+class StockAnalyzer:
+    def __init__(self, watchlist=None, use_sample_fallback=True, compress_output=False):
+        if watchlist is None:
+            watchlist = {
+                'US': ['AAPL', 'MSFT', 'TSLA', 'NVDA', 'GOOGL', 'META', 'AMZN', 'NFLX'],
+                'UK': ['TSCO.L', 'HSBA.L', 'LLOY.L', 'VOD.L', 'BARC.L'],
+                'EU': ['AIR.PA', 'SIE.DE', 'ASML.AS', 'SAF.PA', 'BMW.DE']
+            }
+        self.watchlist = watchlist
+        
+        # Fill in random sample data for tickers no source could provide
+        self.use_sample_fallback = use_sample_fallback
+        self._rng = np.random.default_rng()
+        
+        # Gzip the results for large watchlists; the dashboard reads the plain file
+        self.compress_output = compress_output
+        
+        # Every record of one update shares a single snapshot timestamp
+        self._run_ts = None
         
-        # User agents to rotate to avoid blocking
-        self.user_agents = [
-            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
-            'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36',
-        ]
+        # Regular trading session per region as (timezone, open, close)
+        self.market_hours = {
+            'US': ('America/New_York', (9, 30), (16, 0)),
+            'UK': ('Europe/London', (8, 0), (16, 30)),
+            'EU': ('Europe/Paris', (9, 0), (17, 30))
+        }
+        
+        # Fetches are network-bound, so a small thread pool overlaps them
+        self.max_workers = 8
+        
+        # Cap concurrent Yahoo requests below the pool size to stay clear of throttling
+        self._yahoo_slots = threading.Semaphore(5)
+        
+        # One pooled session so per-ticker requests reuse keep-alive connections,
+        # with a couple of backed-off retries for throttling and server errors
+        self.session = requests.Session()
+        retries = Retry(total=2, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers,
+                              max_retries=retries)
+        self.session.mount('https://', adapter)
+        
+        # Daily bars are cached on disk so reruns only download the newest ones
+        self.cache_dir = 'data/cache'
+        self.history_cache = CachedHistory(self.cache_dir)
+        
+        # Confidence rules as threshold bands: a value above thresholds[k-1] and at
+        # most thresholds[k] earns points[k]. The lowest band is strict (< -2, < 0.8)
+        self._momentum_thresholds = np.array([np.nextafter(-2, -np.inf), 0, 1, 3])
+        self._momentum_points = np.array([-10, 0, 6, 12, 20])
+        self._volume_thresholds = np.array([np.nextafter(0.8, -np.inf), 1.2, 1.5, 2.0])
+        self._volume_points = np.array([-5, 0, 5, 10, 15])
+        
+        # Whether the compiled score kernel matches the tables, checked on first use
+        self._kernel_agrees = None
+        
+        # Analysis text only depends on a few bands, so every sentence is built once
+        self._analysis_table = self.build_analysis_table()
+    
+    def run_timestamp(self):
+        """Timestamp of the current update, or of now when used outside one"""
+        return self._run_ts or datetime.now().isoformat()
+    
+    def download_history(self, tickers, **period_kwargs):
+        """Download daily bars for several tickers in a single yfinance request"""
+        histories = {}
+        try:
+            data = yf.download(tickers, group_by='ticker', auto_adjust=True, ignore_tz=True,
+                               threads=True, progress=False, **period_kwargs)
+        except Exception as e:
+            log.info("  ❌ Batch download failed: %.50s", e)
+            return histories
+        
+        if data.empty:
+            return histories
+        
+        for ticker in tickers:
+            # A single-ticker download comes back without the ticker column level
+            if isinstance(data.columns, pd.MultiIndex):
+                if ticker not in data.columns.get_level_values(0):
+                    continue
+                hist = data[ticker]
+            else:
+                hist = data
+            
+            hist = hist.dropna()
+            if not hist.empty:
+                histories[ticker] = hist
+        
+        return histories
+    
+    def fetch_batch_history(self, tickers):
+        """Get recent history for all tickers, downloading only bars missing from the cache"""
+        cache = self.history_cache
+        histories = {}
+        
+        # Recently refreshed tickers are served straight from disk
+        for ticker in tickers:
+            if cache.is_fresh(ticker):
+                hist = cache.get(ticker)
+                if hist is not None and len(hist) > 5:
+                    histories[ticker] = hist
+        reused = len(histories)
+        
+        stale = [ticker for ticker in tickers
+                 if ticker not in histories and cache.last_bar(ticker) is not None]
+        missing = [ticker for ticker in tickers if ticker not in histories and ticker not in stale]
+        
+        downloaded = {}
+        held = {}
+        updated = 0
+        if stale:
+            # Re-fetch from the oldest last bar so a partial intraday bar gets replaced
+            start = min(cache.last_bar(ticker) for ticker in stale)
+            updates = self.download_history(stale, start=start.strftime('%Y-%m-%d'))
+            for ticker in stale:
+                hist = cache.get(ticker)
+                if hist is None:
+                    missing.append(ticker)
+                elif ticker in updates:
+                    hist = pd.concat([hist, updates[ticker]])
+                    downloaded[ticker] = hist[~hist.index.duplicated(keep='last')]
+                    updated += 1
+                else:
+                    # Old bars still serve this run, but fetched_at is left alone so the next run retries
+                    held[ticker] = hist
+        
+        if missing:
+            downloaded.update(self.download_history(missing, period="3mo"))
+        # Yahoo drops the odd symbol from large batches, so retry those once together
+        dropped = [ticker for ticker in missing if ticker not in downloaded] + list(held)
+        if dropped:
+            downloaded.update(self.download_history(dropped, period="3mo"))
+        
+        cutoff = pd.Timestamp(datetime.now() - timedelta(days=92))
+        for ticker, hist in {**held, **downloaded}.items():
+            hist = hist.sort_index()
+            hist = hist[hist.index >= cutoff]
+            if len(hist) > 5:
+                histories[ticker] = hist
+                # Only tickers that actually got new bars renew their cache entry
+                if ticker in downloaded:
+                    cache.put(ticker, hist)
+        cache.save_meta()
+        
+        left_stale = [ticker for ticker in held if ticker not in downloaded]
+        log.info("📦 History for %d/%d stocks (%d fresh in cache, %d updated, %d downloaded in full, "
+                 "%d left stale)", len(histories), len(tickers), reused,
+                 updated, len(missing), len(left_stale))
+        return histories
     
     def get_stock_data_alternative(self, ticker):
         """Try alternative methods to get stock data"""
         try:
-            print(f"📊 Attempting to fetch {ticker}...")
+            log.info("📊 Attempting to fetch %s...", ticker)
             
-            # Method 1: Try yfinance with different parameters
+            # Method 1: Try yfinance for this ticker alone. A single 3mo request
+            # matches the batch window; shorter periods would not return more rows
             try:
-                stock = yf.Ticker(ticker)
-                # Try different period parameters
-                for period in ["1mo", "2mo", "3mo", "6mo"]:
-                    try:
-                        hist = stock.history(period=period)
-                        if len(hist) > 5:
-                            print(f"  ✅ Success with period={period}")
-                            return self.process_yfinance_data(ticker, hist)
-                    except:
-                        continue
+                stock = yf.Ticker(ticker, session=self.session)
+                with self._yahoo_slots:
+                    hist = stock.history(period="3mo")
+                if len(hist) > 5:
+                    log.info("  ✅ Success with per-ticker history")
+                    return self.process_yfinance_data(ticker, hist)
             except Exception as e:
-                print(f"  ❌ yfinance failed: {str(e)[:50]}")
+                log.info("  ❌ yfinance failed: %.50s", e)
             
             # Method 2: Try Alpha Vantage fallback (if API key available)
             alpha_data = self.try_alpha_vantage(ticker)
             if alpha_data:
                 return alpha_data
-                
-            # Method 3: Use static sample data as last resort
-            return self.generate_sample_data(ticker)
             
         except Exception as e:
-            print(f"  ❌ All methods failed for {ticker}: {str(e)[:50]}")
-            return self.generate_sample_data(ticker)
+            log.info("  ❌ All methods failed for %s: %.50s", ticker, e)
+        
+        # Sample data for the last resort is generated in one batch by update_all_stocks
+        return None
     
-    def process_yfinance_data(self, ticker, hist):
-        """Process successful yfinance data"""
-        if len(hist) < 5:
-            return None
+    def stack_tail(self, histories, tickers, column, length):
+        """Right-align the last `length` values of a column into a (ticker x day) array"""
+        stacked = np.full((len(tickers), length), np.nan)
+        for i, ticker in enumerate(tickers):
+            values = histories[ticker][column].to_numpy(dtype=np.float64)[-length:]
+            stacked[i, length - len(values):] = values
+        return stacked
+    
+    def process_yfinance_batch(self, histories):
+        """Process yfinance history for many tickers at once"""
+        tickers = [ticker for ticker, hist in histories.items() if len(hist) >= 5]
+        if not tickers:
+            return {}
+        
+        # Only the last 2 closes and the last 20 volumes are needed. Both stay
+        # float64: percent changes are compared against band edges, where float32
+        # rounding would flip exact moves like -2.00% into the neighbouring band
+        closes = self.stack_tail(histories, tickers, 'Close', 2)
+        volumes = self.stack_tail(histories, tickers, 'Volume', 20)
+        
+        current_prices = closes[:, -1]
+        prev_closes = closes[:, -2]
+        price_changes = current_prices - prev_closes
+        price_change_pcts = (price_changes / prev_closes) * 100
+        
+        current_volumes = volumes[:, -1]
+        full_window = ~np.isnan(volumes).any(axis=1)
+        avg_volumes = np.where(full_window, volumes.mean(axis=1), current_volumes)
+        volume_ratios = np.divide(current_volumes, avg_volumes,
+                                  out=np.ones_like(avg_volumes), where=avg_volumes > 0)
+        
+        # Score the whole batch in one call
+        confidence_scores = self.score_batch(price_change_pcts, volume_ratios)
+        
+        return self.build_records(tickers, current_prices, price_changes, price_change_pcts,
+                                  current_volumes, volume_ratios, confidence_scores,
+                                  "Live market data analysis", 'yfinance',
+                                  "  ✅ %s: $%.2f (%+.2f%%) - Score: %d/100")
+    
+    def build_records(self, tickers, current_prices, price_changes, price_change_pcts,
+                      volumes, volume_ratios, confidence_scores, catalyst, source, log_format):
+        """Turn per-ticker arrays into output records, logging one line per ticker"""
+        # Round every reported field in one pass; records come back as native Python types
+        reported = pd.DataFrame({
+            'ticker': tickers,
+            'current_price': current_prices,
+            'price_change': price_changes,
+            'price_change_percent': price_change_pcts,
+            'volume': volumes.astype(np.int64),
+            'volume_ratio': volume_ratios
+        }).round(2)
+        
+        results = {}
+        for i, stock_data in enumerate(reported.to_dict(orient='records')):
+            ticker = stock_data['ticker']
+            confidence_score = int(confidence_scores[i])
+            stock_data.update({
+                'company_name': self.get_company_name(ticker),
+                'confidence_score': confidence_score,
+                'analysis': self.generate_analysis(confidence_score, price_change_pcts[i], volume_ratios[i]),
+                'catalyst': catalyst,
+                'data_source': source,
+                'last_updated': self.run_timestamp()
+            })
+            results[ticker] = stock_data
             
-        # Get the most recent valid data
-        current_price = hist['Close'].iloc[-1]
-        prev_close = hist['Close'].iloc[-2] if len(hist) >= 2 else current_price
-        price_change = current_price - prev_close
-        price_change_pct = (price_change / prev_close) * 100
-        
-        current_volume = hist['Volume'].iloc[-1]
-        avg_volume = hist['Volume'].tail(20).mean() if len(hist) >= 20 else current_volume
-        volume_ratio = current_volume / avg_volume if avg_volume > 0 else 1
-        
-        # Calculate confidence score
-        confidence_score = self.calculate_confidence_score(price_change_pct, volume_ratio, hist)
-        
-        stock_data = {
-            'ticker': ticker,
-            'current_price': round(current_price, 2),
-            'price_change': round(price_change, 2),
-            'price_change_percent': round(price_change_pct, 2),
-            'volume': int(current_volume),
-            'volume_ratio': round(volume_ratio, 2),
-            'company_name': self.get_company_name(ticker),
-            'confidence_score': confidence_score,
-            'analysis': self.generate_analysis(confidence_score, price_change_pct, volume_ratio),
-            'catalyst': "Live market data analysis",
-            'data_source': 'yfinance',
-            'last_updated': datetime.now().isoformat()
-        }
+            log.info(log_format, ticker, current_prices[i], price_change_pcts[i], confidence_score)
         
-        print(f"  ✅ {ticker}: ${current_price:.2f} ({price_change_pct:+.2f}%) - Score: {confidence_score}/100")
-        return stock_data
+        return results
+    
+    def process_yfinance_data(self, ticker, hist):
+        """Process successful yfinance data"""
+        return self.process_yfinance_batch({ticker: hist}).get(ticker)
     
     def try_alpha_vantage(self, ticker):
         """Try Alpha Vantage as fallback"""
@@ -99,7 +408,8 @@ class RobustStockAnalyzer:
             
         try:
             url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={ticker}&apikey={alpha_key}"
-            response = requests.get(url, timeout=10)
+            response = self.session.get(url, timeout=10,
+                                        headers={'User-Agent': random.choice(_USER_AGENTS)})
             data = response.json()
             
             if 'Global Quote' in data:
@@ -124,175 +434,276 @@ class RobustStockAnalyzer:
                     'analysis': self.generate_analysis(confidence_score, price_change_pct, 1.0),
                     'catalyst': "Alpha Vantage API data",
                     'data_source': 'alphavantage',
-                    'last_updated': datetime.now().isoformat()
+                    'last_updated': self.run_timestamp()
                 }
         except:
             pass
             
         return None
     
-    def generate_sample_data(self, ticker):
-        """Generate realistic sample data when APIs fail"""
-        # Realistic price ranges for each stock
-        price_ranges = {
-            'AAPL': (150, 200), 'MSFT': (300, 400), 'TSLA': (150, 300), 
-            'NVDA': (400, 800), 'GOOGL': (120, 150), 'META': (300, 400),
-            'AMZN': (120, 180), 'NFLX': (500, 700), 'TSCO.L': (2.5, 3.5),
-            'HSBA.L': (6, 8), 'LLOY.L': (0.4, 0.6), 'VOD.L': (0.6, 0.9),
-            'BARC.L': (1.5, 2.0), 'AIR.PA': (120, 160), 'SIE.DE': (140, 180),
-            'ASML.AS': (600, 800), 'SAF.PA': (180, 220), 'BMW.DE': (80, 110)
-        }
+    def generate_sample_batch(self, tickers):
+        """Generate realistic sample data for every ticker the APIs failed on"""
+        if not tickers:
+            return {}
         
-        base_price = random.uniform(*price_ranges.get(ticker, (50, 100)))
-        price_change_pct = random.uniform(-3, 5)
-        price_change = base_price * (price_change_pct / 100)
-        current_price = base_price + price_change
-        
-        volume_ratio = random.uniform(0.8, 2.5)
-        confidence_score = random.randint(40, 85)
-        
-        stock_data = {
-            'ticker': ticker,
-            'current_price': round(current_price, 2),
-            'price_change': round(price_change, 2),
-            'price_change_percent': round(price_change_pct, 2),
-            'volume': random.randint(1000000, 50000000),
-            'volume_ratio': round(volume_ratio, 2),
-            'company_name': self.get_company_name(ticker),
-            'confidence_score': confidence_score,
-            'analysis': self.generate_analysis(confidence_score, price_change_pct, volume_ratio),
-            'catalyst': "Sample data - API limited",
-            'data_source': 'sample',
-            'last_updated': datetime.now().isoformat()
-        }
+        count = len(tickers)
+        ranges = np.array([_PRICE_RANGES.get(ticker, (50, 100)) for ticker in tickers], dtype=np.float64)
+        base_prices = self._rng.uniform(ranges[:, 0], ranges[:, 1])
+        price_change_pcts = self._rng.uniform(-3, 5, size=count)
+        price_changes = base_prices * (price_change_pcts / 100)
+        current_prices = base_prices + price_changes
         
-        print(f"  📝 {ticker}: ${current_price:.2f} ({price_change_pct:+.2f}%) - Score: {confidence_score}/100 [SAMPLE]")
-        return stock_data
+        volume_ratios = self._rng.uniform(0.8, 2.5, size=count)
+        confidence_scores = self._rng.integers(40, 85, size=count, endpoint=True)
+        volumes = self._rng.integers(1000000, 50000000, size=count, endpoint=True)
+        
+        return self.build_records(tickers, current_prices, price_changes, price_change_pcts,
+                                  volumes, volume_ratios, confidence_scores,
+                                  "Sample data - API limited", 'sample',
+                                  "  📝 %s: $%.2f (%+.2f%%) - Score: %d/100 [SAMPLE]")
+    
+    def generate_sample_data(self, ticker):
+        """Generate realistic sample data when APIs fail"""
+        return self.generate_sample_batch([ticker])[ticker]
+    
+    def score_points(self, values, thresholds, points):
+        """Look up the points for each value's threshold band without branching"""
+        values = np.asarray(values, dtype=np.float64)
+        banded = points[np.searchsorted(thresholds, values)]
+        # Missing values score nothing, as the comparisons they replace would
+        return np.where(np.isnan(values), 0, banded)
+    
+    def score_tables(self, price_change_pcts, volume_ratios):
+        """Score arrays of price changes and volume ratios with searchsorted table lookups"""
+        scores = (50
+                  + self.score_points(price_change_pcts, self._momentum_thresholds, self._momentum_points)
+                  + self.score_points(volume_ratios, self._volume_thresholds, self._volume_points))
+        return np.clip(scores, 0, 100).astype(int)
+    
+    def run_score_kernel(self, price_change_pcts, volume_ratios):
+        """Score arrays with the compiled kernel, fed from the same threshold tables"""
+        return _score_kernel(np.asarray(price_change_pcts, dtype=np.float64),
+                             np.asarray(volume_ratios, dtype=np.float64),
+                             self._momentum_thresholds, self._momentum_points,
+                             self._volume_thresholds, self._volume_points).astype(int)
+    
+    def score_kernel_agrees(self):
+        """Check once that the kernel and the table lookups score every band edge alike"""
+        if self._kernel_agrees is None:
+            def probes(thresholds):
+                return np.concatenate([thresholds, np.nextafter(thresholds, -np.inf),
+                                       np.nextafter(thresholds, np.inf), [np.nan]])
+            pcts, ratios = np.meshgrid(probes(self._momentum_thresholds), probes(self._volume_thresholds))
+            pcts, ratios = pcts.ravel(), ratios.ravel()
+            self._kernel_agrees = bool(np.array_equal(self.run_score_kernel(pcts, ratios),
+                                                      self.score_tables(pcts, ratios)))
+            if not self._kernel_agrees:
+                log.warning("  ⚠️ Score kernel disagrees with the threshold tables; using table lookups")
+        return self._kernel_agrees
+    
+    def score_batch(self, price_change_pcts, volume_ratios):
+        """Calculate confidence scores for arrays of price changes and volume ratios"""
+        if (_score_kernel is not None and np.size(price_change_pcts) >= _KERNEL_MIN_BATCH
+                and self.score_kernel_agrees()):
+            return self.run_score_kernel(price_change_pcts, volume_ratios)
+        return self.score_tables(price_change_pcts, volume_ratios)
     
     def calculate_confidence_score(self, price_change_pct, volume_ratio, hist_data):
         """Calculate confidence score based on available data"""
-        score = 50
-        
-        # Price momentum
-        if price_change_pct > 3:
-            score += 20
-        elif price_change_pct > 1:
-            score += 12
-        elif price_change_pct > 0:
-            score += 6
-        elif price_change_pct < -2:
-            score -= 10
-        
-        # Volume confirmation
-        if volume_ratio > 2.0:
-            score += 15
-        elif volume_ratio > 1.5:
-            score += 10
-        elif volume_ratio > 1.2:
-            score += 5
-        elif volume_ratio < 0.8:
-            score -= 5
-        
-        return min(max(score, 0), 100)
+        return int(self.score_batch(price_change_pct, volume_ratio))
     
     def get_company_name(self, ticker):
         """Get company names"""
-        name_map = {
-            'AAPL': 'Apple Inc.', 'MSFT': 'Microsoft Corporation', 
-            'TSLA': 'Tesla Inc.', 'NVDA': 'NVIDIA Corporation',
-            'GOOGL': 'Alphabet Inc.', 'META': 'Meta Platforms Inc.',
-            'AMZN': 'Amazon.com Inc.', 'NFLX': 'Netflix Inc.',
-            'TSCO.L': 'Tesco PLC', 'HSBA.L': 'HSBC Holdings PLC',
-            'LLOY.L': 'Lloyds Banking Group', 'VOD.L': 'Vodafone Group PLC',
-            'BARC.L': 'Barclays PLC', 'AIR.PA': 'Airbus SE',
-            'SIE.DE': 'Siemens AG', 'ASML.AS': 'ASML Holding NV',
-            'SAF.PA': 'Safran SA', 'BMW.DE': 'BMW AG'
+        return _NAME_MAP.get(ticker, ticker)
+    
+    def build_analysis_table(self):
+        """Precompute every analysis sentence, keyed by (score, trend, volume) band"""
+        bases = (
+            "🔄 Needs stronger signals",
+            "⚡ Watch for confirmation",
+            "📈 Positive trend developing",
+            "🚀 Strong bullish momentum",
+        )
+        trends = (
+            "consolidating at current levels",
+            "with positive price action",
+            "with significant price movement",
+        )
+        volumes = (
+            "volume below average",
+            "on average volume",
+            "on high volume",
+        )
+        return {
+            (score_band, trend_band, volume_band): f"{base} {trend} {volume}"
+            for score_band, base in enumerate(bases)
+            for trend_band, trend in enumerate(trends)
+            for volume_band, volume in enumerate(volumes)
         }
-        return name_map.get(ticker, ticker)
     
     def generate_analysis(self, score, price_change_pct, volume_ratio):
         """Generate analysis text"""
-        if score >= 75:
-            base = "🚀 Strong bullish momentum"
-        elif score >= 60:
-            base = "📈 Positive trend developing"
-        elif score >= 45:
-            base = "⚡ Watch for confirmation"
+        score_band = int(score >= 45) + int(score >= 60) + int(score >= 75)
+        trend_band = int(price_change_pct > 0) + int(price_change_pct > 2)
+        volume_band = int(volume_ratio > 1.0) + int(volume_ratio > 1.5)
+        return self._analysis_table[(score_band, trend_band, volume_band)]
+    
+    def close(self):
+        """Release pooled HTTP connections"""
+        self.session.close()
+    
+    def save_output(self, output, output_path):
+        """Write the results JSON, using orjson when it is installed and gzip for .gz paths"""
+        if orjson is not None:
+            payload = orjson.dumps(output, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
         else:
-            base = "🔄 Needs stronger signals"
+            payload = json.dumps(output, indent=2).encode('utf-8')
         
-        if price_change_pct > 2:
-            trend = "with significant price movement"
-        elif price_change_pct > 0:
-            trend = "with positive price action"
+        if output_path.endswith('.gz'):
+            # Level 3 is close to the fastest setting and still shrinks the file severalfold
+            with gzip.open(output_path, 'wb', compresslevel=3) as f:
+                f.write(payload)
         else:
-            trend = "consolidating at current levels"
+            with open(output_path, 'wb') as f:
+                f.write(payload)
+    
+    def market_is_settled(self, region, since):
+        """Check that a region is closed and has not closed again after `since`"""
+        tz_name, (open_hour, open_minute), (close_hour, close_minute) = self.market_hours[region]
+        now = datetime.now(timezone.utc).astimezone(ZoneInfo(tz_name))
         
-        if volume_ratio > 1.5:
-            volume = "on high volume"
-        elif volume_ratio > 1.0:
-            volume = "on average volume"
-        else:
-            volume = "volume below average"
+        session_open = now.replace(hour=open_hour, minute=open_minute, second=0, microsecond=0)
+        session_close = now.replace(hour=close_hour, minute=close_minute, second=0, microsecond=0)
+        if now.weekday() < 5 and session_open <= now < session_close:
+            return False
         
-        return f"{base} {trend} {volume}"
+        # Most recent weekday close; exchange holidays are not tracked
+        last_close = session_close
+        if last_close > now:
+            last_close -= timedelta(days=1)
+        while last_close.weekday() >= 5:
+            last_close -= timedelta(days=1)
+        return since >= last_close
     
-    def update_all_stocks(self):
-        """Update all stocks with robust error handling"""
-        print("🚀 Starting robust stock analysis...")
-        print("💡 Using multiple data sources with fallbacks")
-        
-        all_stocks = []
-        
-        for region, tickers in self.watchlist.items():
-            print(f"\n🌍 Analyzing {region} stocks:")
-            for i, ticker in enumerate(tickers):
-                stock_data = self.get_stock_data_alternative(ticker)
-                if stock_data:
-                    stock_data['region'] = region
-                    all_stocks.append(stock_data)
-                
-                # Random delay to avoid detection
-                if i < len(tickers) - 1:
-                    delay = random.uniform(2, 5)
-                    print(f"    ⏳ Waiting {delay:.1f} seconds...")
-                    time.sleep(delay)
-        
-        # Sort by confidence score
-        all_stocks.sort(key=lambda x: x['confidence_score'], reverse=True)
-        
-        # Count data sources
-        sources = {}
-        for stock in all_stocks:
-            source = stock.get('data_source', 'unknown')
-            sources[source] = sources.get(source, 0) + 1
-        
-        # Save results
-        output = {
-            'last_updated': datetime.now().isoformat(),
-            'total_stocks_analyzed': len(all_stocks),
-            'data_sources': sources,
-            'stocks': all_stocks
-        }
+    def load_fresh_output(self, output_path):
+        """Return the previous results if no market has moved since they were written"""
+        opener = gzip.open if output_path.endswith('.gz') else open
+        try:
+            with opener(output_path, 'rt', encoding='utf-8') as f:
+                previous = json.load(f)
+            # Timestamps are written in local time without an offset
+            last_updated = datetime.fromisoformat(previous['last_updated']).astimezone()
+        except (OSError, ValueError, KeyError):
+            return None
         
-        os.makedirs('data/processed', exist_ok=True)
-        output_path = 'data/processed/latest_stocks.json'
+        # Never hold on to placeholder data, or to results for a different watchlist
+        if previous.get('data_sources', {}).get('sample'):
+            return None
+        analyzed = {stock.get('ticker') for stock in previous.get('stocks', [])}
+        if any(ticker not in analyzed for tickers in self.watchlist.values() for ticker in tickers):
+            return None
         
-        with open(output_path, 'w') as f:
-            json.dump(output, f, indent=2)
-            
-        print(f"\n🎉 SUCCESS: Analyzed {len(all_stocks)} stocks")
-        print(f"📊 Data sources: {sources}")
-        print(f"💾 Data saved to: {output_path}")
+        for region in self.watchlist:
+            if region not in self.market_hours or not self.market_is_settled(region, last_updated):
+                return None
+        return previous
+    
+    def update_all_stocks(self, force=False):
+        """Update all stocks with robust error handling"""
+        log.info("🚀 Starting robust stock analysis...")
+        log.info("💡 Using multiple data sources with fallbacks")
         
-        if all_stocks:
-            print(f"\n🏆 Top stocks by confidence:")
-            for i, stock in enumerate(all_stocks[:8]):
+        # Records and the file share one stamp; it is cleared afterwards so direct
+        # calls outside an update fall back to the current time
+        self._run_ts = datetime.now().isoformat()
+        try:
+            output_path = 'data/processed/latest_stocks.json'
+            if self.compress_output:
+                output_path += '.gz'
+            if not force:
+                previous = self.load_fresh_output(output_path)
+                if previous is not None:
+                    log.info("✅ Up to date: no market has closed since %s", previous['last_updated'])
+                    return previous['stocks']
+            
+            all_stocks = []
+            jobs = [(region, ticker) for region, tickers in self.watchlist.items() for ticker in tickers]
+            log.info("\n🌍 Analyzing %d stocks across %d regions:", len(jobs), len(self.watchlist))
+            
+            # One request for all price histories, analyzed together as a batch
+            histories = self.fetch_batch_history([ticker for _, ticker in jobs])
+            batch_results = self.process_yfinance_batch(histories)
+            
+            for region, ticker in jobs:
+                if ticker in batch_results:
+                    batch_results[ticker]['region'] = region
+                    all_stocks.append(batch_results[ticker])
+            
+            # The pool only handles tickers the batch could not cover
+            failed = []
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {
+                    executor.submit(self.get_stock_data_alternative, ticker): (region, ticker)
+                    for region, ticker in jobs if ticker not in batch_results
+                }
+                for future in as_completed(futures):
+                    stock_data = future.result()
+                    if stock_data:
+                        stock_data['region'] = futures[future][0]
+                        all_stocks.append(stock_data)
+                    else:
+                        failed.append(futures[future])
+            
+            # Use sample data as a last resort, generated for all failures at once
+            if failed and self.use_sample_fallback:
+                samples = self.generate_sample_batch([ticker for _, ticker in failed])
+                for region, ticker in failed:
+                    samples[ticker]['region'] = region
+                    all_stocks.append(samples[ticker])
+            
+            # Sort by confidence score
+            all_stocks.sort(key=lambda x: x['confidence_score'], reverse=True)
+            
+            # Count data sources
+            sources = {}
+            for stock in all_stocks:
                 source = stock.get('data_source', 'unknown')
-                print(f"   {i+1}. {stock['ticker']}: {stock['confidence_score']}/100 [{source}]")
-        
-        return all_stocks
+                sources[source] = sources.get(source, 0) + 1
+            
+            # Save results
+            output = {
+                'last_updated': self.run_timestamp(),
+                'total_stocks_analyzed': len(all_stocks),
+                'data_sources': sources,
+                'stocks': all_stocks
+            }
+            
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            self.save_output(output, output_path)
+                
+            log.info("\n🎉 SUCCESS: Analyzed %d stocks", len(all_stocks))
+            log.info("📊 Data sources: %s", sources)
+            log.info("💾 Data saved to: %s", output_path)
+            
+            if all_stocks:
+                log.info("\n🏆 Top stocks by confidence:")
+                for i, stock in enumerate(all_stocks[:8]):
+                    source = stock.get('data_source', 'unknown')
+                    log.info("   %d. %s: %d/100 [%s]", i + 1, stock['ticker'], stock['confidence_score'], source)
+            
+            return all_stocks
+        finally:
+            self._run_ts = None
+
+# Older name, kept so existing imports keep working
+RobustStockAnalyzer = StockAnalyzer
 
 if __name__ == "__main__":
-    analyzer = RobustStockAnalyzer()
-    analyzer.update_all_stocks()
+    # --quiet keeps warnings only, e.g. for scheduled runs
+    logging.basicConfig(level=logging.WARNING if '--quiet' in sys.argv[1:] else logging.INFO,
+                        format='%(message)s', stream=sys.stdout)
+    analyzer = StockAnalyzer()
+    try:
+        analyzer.update_all_stocks(force='--force' in sys.argv[1:])
+    finally:
+        analyzer.close()